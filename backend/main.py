@@ -2,19 +2,31 @@ from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
-import PyPDF2
-import io
+import fitz  # PyMuPDF
+import aiofiles
+from cachetools import TTLCache
 import os
+import stat
 from datetime import datetime
 import uuid
+import io
 import json
+import re
+import time
 import zipfile
-from fastapi.responses import FileResponse
+import threading
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import multiprocessing
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 app = FastAPI(
     title="PDF Agent Splitter API",
     description="API for splitting PDF documents and extracting specific pages",
-    version="1.1.1"  # Updated version
+    version="2.0.0"  # /batch-process now streams the ZIP instead of returning JSON
 )
 
 # CORS configuration
@@ -46,56 +58,259 @@ class PDFSplitResponse(BaseModel):
     metadata: Optional[PDFMetadata] = None
     extracted_text: Optional[str] = None
     file_size: Optional[str] = None
-
-class BatchProcessResponse(BaseModel):
-    status: str
-    message: Optional[str] = None
-    download_url: Optional[str] = None
-    processed_files: int = 0
-    total_files: int = 0
-    errors: List[str] = []
+    file_id: Optional[str] = None
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def get_pdf_metadata(pdf_reader):
-    metadata = getattr(pdf_reader, 'metadata', None) or {}
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+# Files in UPLOAD_DIR older than this are removed by the periodic cleanup task
+UPLOAD_TTL_SECONDS = int(os.environ.get("UPLOAD_TTL_SECONDS", "3600"))
+CLEANUP_INTERVAL_SECONDS = 300
+
+# Page selections look like "1,3,5-8"; tokenizing with one compiled regex keeps
+# long selections out of per-part Python string handling
+PAGE_RANGE_RE = re.compile(r'(\d+)(?:\s*-\s*(\d+))?')
+PAGE_SELECTION_RE = re.compile(r'\s*\d+(?:\s*-\s*\d+)?\s*(?:,\s*\d+(?:\s*-\s*\d+)?\s*)*')
+
+# Queue depth between batch pipeline stages
+BATCH_QUEUE_SIZE = 4
+
+# PyMuPDF must not be used from several threads at once, so every in-process
+# fitz call runs on this one thread. That is only the work on cached documents
+# (/upload, and /split by file_id); anything else goes to the process pool,
+# which is where the CPU parallelism comes from.
+PDF_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mupdf")
+
+# Size of the process pool shared by /batch-process and /split with an uploaded
+# file, and so how many of those PDFs are open at once across all requests. Each worker carries its own PyMuPDF plus a parsed
+# document and its output, so tune this to the memory available to the server
+# rather than to its core count.
+PDF_CONCURRENCY = max(1, int(os.environ.get("PDF_CONCURRENCY", "4")))
+
+class DocumentCache(TTLCache):
+    """TTLCache that closes documents as they are evicted or expire"""
+    def popitem(self):
+        file_id, pdf_doc = super().popitem()
+        pdf_doc.close()
+        return file_id, pdf_doc
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, pdf_doc in expired:
+            pdf_doc.close()
+        return expired
+
+# Documents parsed by /upload, keyed by file_id, so /split can reuse them.
+# Only touched from PDF_EXECUTOR's thread, which is also the only thread that
+# uses the documents, so a cached document is never evicted mid-split. The
+# lock guards the cache itself should it ever be reached from elsewhere.
+DOCUMENT_CACHE = DocumentCache(maxsize=128, ttl=1800)
+DOCUMENT_CACHE_LOCK = threading.Lock()
+
+def get_pdf_metadata(pdf_doc):
+    metadata = pdf_doc.metadata or {}
     return PDFMetadata(
-        title=str(metadata.get('title', '')) if metadata.get('title') else "",
-        author=str(metadata.get('author', '')) if metadata.get('author') else "",
-        creator=str(metadata.get('creator', '')) if metadata.get('creator') else "",
-        producer=str(metadata.get('producer', '')) if metadata.get('producer') else "",
-        creation_date=str(metadata.get('/CreationDate', '')) if metadata.get('/CreationDate') else "",
-        modification_date=str(metadata.get('/ModDate', '')) if metadata.get('/ModDate') else "",
-        total_pages=len(pdf_reader.pages)
+        title=metadata.get('title') or "",
+        author=metadata.get('author') or "",
+        creator=metadata.get('creator') or "",
+        producer=metadata.get('producer') or "",
+        creation_date=metadata.get('creationDate') or "",
+        modification_date=metadata.get('modDate') or "",
+        total_pages=pdf_doc.page_count
     )
 
-def extract_text_from_pages(pdf_reader, pages):
-    text = ""
+def extract_text_from_pages(pdf_doc, pages):
+    parts = []
     for page_num in pages:
-        if 0 < page_num <= len(pdf_reader.pages):
-            page = pdf_reader.pages[page_num - 1]
-            text += f"=== Page {page_num} ===\n{page.extract_text()}\n\n"
-    return text.strip()
+        if 0 < page_num <= pdf_doc.page_count:
+            page = pdf_doc[page_num - 1]
+            parts.append(f"=== Page {page_num} ===\n{page.get_text()}")
+    return "\n\n".join(parts).strip()
 
 def parse_page_selection(pages_str: str, max_pages: int) -> List[int]:
     """Parse page selection string into list of page numbers"""
-    page_numbers = []
-    for part in pages_str.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = map(int, part.split('-'))
+    if not PAGE_SELECTION_RE.fullmatch(pages_str):
+        raise ValueError(f"Invalid page selection '{pages_str}' (use e.g. 1,3 or 1-5)")
+    
+    page_numbers = set()
+    for start, end in PAGE_RANGE_RE.findall(pages_str):
+        if end:
+            start, end = int(start), int(end)
+            if start > end:
+                raise ValueError(f"Page range {start}-{end} is reversed")
             if start < 1 or end > max_pages:
                 raise ValueError(f"Page range {start}-{end} is out of range (1-{max_pages})")
-            page_numbers.extend(range(start, end + 1))
+            page_numbers.update(range(start, end + 1))
         else:
-            page_num = int(part)
+            page_num = int(start)
             if page_num < 1 or page_num > max_pages:
                 raise ValueError(f"Page {page_num} is out of range (1-{max_pages})")
-            page_numbers.append(page_num)
+            page_numbers.add(page_num)
+    
+    # The set already dropped duplicates, so one sort is all that's left
+    return sorted(page_numbers)
+
+async def save_upload(file: UploadFile, path: str) -> None:
+    """Stream an uploaded file to disk in fixed-size chunks"""
+    async with aiofiles.open(path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
+
+def remove_if_exists(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # Already removed by the cleanup task or a finished download
+        pass
+
+def remove_expired_files(directory: str, ttl: int) -> None:
+    """Delete files in directory that haven't been modified for ttl seconds"""
+    cutoff = time.time() - ttl
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                # Already removed by a request finishing at the same time, or not
+                # removable right now; either way it shouldn't stop the rest of the scan
+                continue
+
+async def cleanup_uploads():
+    while True:
+        await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(remove_expired_files, UPLOAD_DIR, UPLOAD_TTL_SECONDS)
+        except OSError:
+            # Try again on the next pass rather than stopping cleanup for good
+            continue
+
+def get_cached_document(file_id: str):
+    """Return the parsed document for an earlier upload, reopening it from disk on a cache miss"""
+    # Only accept ids we could have generated, so file_id can't be used to walk the filesystem
+    file_id = str(uuid.UUID(file_id))
+    
+    with DOCUMENT_CACHE_LOCK:
+        pdf_doc = DOCUMENT_CACHE.get(file_id)
+        if pdf_doc is None:
+            file_path = os.path.join(UPLOAD_DIR, f"{file_id}.pdf")
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"No uploaded file with id {file_id}")
+            pdf_doc = fitz.open(file_path)
+            DOCUMENT_CACHE[file_id] = pdf_doc
+    return pdf_doc
+
+def split_document(pdf_doc, pages_str: str):
+    """Split an open document, returning (pdf_bytes, metadata, extracted_text)"""
+    page_numbers = parse_page_selection(pages_str, pdf_doc.page_count)
+    metadata = get_pdf_metadata(pdf_doc)
+    
+    extracted_text = extract_text_from_pages(pdf_doc, page_numbers)
     
-    # Remove duplicates and sort
-    return sorted(list(set(page_numbers)))
+    with fitz.open() as output_doc:
+        for page_num in page_numbers:
+            output_doc.insert_pdf(pdf_doc, from_page=page_num - 1, to_page=page_num - 1)
+        
+        # Serialize once; the same bytes are written out and measured
+        output_bytes = output_doc.tobytes()
+    
+    return output_bytes, metadata, extracted_text
+
+def split_cached_document(file_id: str, pages_str: str):
+    """Split the document parsed by /upload; it stays open in the cache"""
+    return split_document(get_cached_document(file_id), pages_str)
+
+def split_file(pdf_path: str, pages_str: str):
+    """Split the PDF at pdf_path; runs in the process pool"""
+    with fitz.open(pdf_path) as pdf_doc:
+        return split_document(pdf_doc, pages_str)
+
+def extract_pages(pdf_path: str, pages_str: str) -> bytes:
+    """Build a new PDF from the selected pages and return its bytes"""
+    with fitz.open(pdf_path) as pdf_doc:
+        page_numbers = parse_page_selection(pages_str, pdf_doc.page_count)
+        with fitz.open() as output_doc:
+            for page_num in page_numbers:
+                output_doc.insert_pdf(pdf_doc, from_page=page_num - 1, to_page=page_num - 1)
+            return output_doc.tobytes()
+
+def open_upload(file_id: str, file_path: str):
+    """Open an uploaded PDF, cache it for a follow-up /split and return its metadata"""
+    pdf_doc = fitz.open(file_path)
+    with DOCUMENT_CACHE_LOCK:
+        DOCUMENT_CACHE[file_id] = pdf_doc
+    return get_pdf_metadata(pdf_doc)
+
+async def run_pdf_work(func, *args, **kwargs):
+    """Run blocking PyMuPDF work on the dedicated MuPDF thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(PDF_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+class ZipChunkSink(io.RawIOBase):
+    """Write-only sink that collects ZIP output so it can be streamed in chunks"""
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def create_batch_executor():
+    # Spawn rather than fork: this process already has threads that may be inside
+    # MuPDF or malloc, and a forked child could inherit their locks held
+    return ProcessPoolExecutor(
+        max_workers=PDF_CONCURRENCY,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+async def run_batch_work(func, *args):
+    """Run func in the process pool, replacing the pool if a worker has died"""
+    global batch_executor
+    executor = batch_executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        # A killed worker (OOM, a MuPDF crash) breaks the pool for good, failing
+        # every later submit. Concurrent jobs see the same break, so only the
+        # first to get here swaps in a new pool.
+        if batch_executor is executor:
+            batch_executor = create_batch_executor()
+            executor.shutdown(wait=False)
+        raise
+
+cleanup_task = None
+batch_executor = None
+
+@app.on_event("startup")
+async def start_cleanup():
+    global cleanup_task
+    cleanup_task = asyncio.create_task(cleanup_uploads())
+
+@app.on_event("shutdown")
+async def stop_cleanup():
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+
+@app.on_event("startup")
+async def start_batch_pool():
+    global batch_executor
+    batch_executor = create_batch_executor()
+
+@app.on_event("shutdown")
+async def stop_batch_pool():
+    if batch_executor is not None:
+        await asyncio.to_thread(batch_executor.shutdown, cancel_futures=True)
 
 @app.post("/upload", response_model=PDFSplitResponse)
 async def upload_pdf(file: UploadFile = File(...)):
@@ -107,139 +322,246 @@ async def upload_pdf(file: UploadFile = File(...)):
         file_id = str(uuid.uuid4())
         file_path = os.path.join(UPLOAD_DIR, f"{file_id}.pdf")
         
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
+        await save_upload(file, file_path)
         
-        # Read the PDF
-        with open(file_path, "rb") as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            metadata = get_pdf_metadata(pdf_reader)
-            file_size = f"{os.path.getsize(file_path) / 1024:.2f} KB"
+        # Read the PDF and keep it parsed for a follow-up /split
+        metadata = await run_pdf_work(open_upload, file_id, file_path)
+        size_bytes = await asyncio.to_thread(os.path.getsize, file_path)
+        file_size = f"{size_bytes / 1024:.2f} KB"
         
         return PDFSplitResponse(
             status="success",
             message="PDF uploaded successfully",
             metadata=metadata,
-            file_size=file_size
+            file_size=file_size,
+            file_id=file_id
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
 @app.post("/split", response_model=PDFSplitResponse)
-async def split_pdf(file: UploadFile = File(...), pages: str = "1", output_format: str = "pdf"):
+async def split_pdf(
+    file: Optional[UploadFile] = File(None),
+    file_id: Optional[str] = None,
+    pages: str = "1",
+    output_format: str = "pdf"
+):
+    if file is None and file_id is None:
+        raise HTTPException(status_code=400, detail="Provide a PDF file or the file_id of an earlier upload")
+    
+    split_id = str(uuid.uuid4())
+    input_path = os.path.join(UPLOAD_DIR, f"{split_id}.pdf")
+    
     try:
-        # Read the PDF first to get total pages
-        pdf_content = await file.read()
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
-        total_pages = len(pdf_reader.pages)
-        
-        # Parse page selection
-        page_numbers = parse_page_selection(pages, total_pages)
-        
-        # Extract metadata
-        metadata = get_pdf_metadata(pdf_reader)
-        
-        # Extract selected pages
-        pdf_writer = PyPDF2.PdfWriter()
-        extracted_text = ""
-        
-        for page_num in page_numbers:
-            page = pdf_reader.pages[page_num - 1]
-            pdf_writer.add_page(page)
-            extracted_text += f"=== Page {page_num} ===\n{page.extract_text()}\n\n"
-        
-        # Prepare output
-        output_buffer = io.BytesIO()
-        pdf_writer.write(output_buffer)
-        output_buffer.seek(0)
+        # Parsing and splitting are blocking CPU work, so keep them off the event loop
+        if file_id is None:
+            # Stream the upload to disk and let MuPDF read it from there. Nothing
+            # here is shared, so it can run in the pool beside other splits.
+            await save_upload(file, input_path)
+            output_bytes, metadata, extracted_text = await run_batch_work(split_file, input_path, pages)
+        else:
+            # The cached document belongs to this process and its MuPDF thread
+            output_bytes, metadata, extracted_text = await run_pdf_work(split_cached_document, file_id, pages)
         
         # Save the output temporarily for download
-        file_id = str(uuid.uuid4())
-        output_path = os.path.join(UPLOAD_DIR, f"{file_id}_split.pdf")
+        output_path = os.path.join(UPLOAD_DIR, f"{split_id}_split.pdf")
         
-        with open(output_path, "wb") as f:
-            f.write(output_buffer.getvalue())
+        async with aiofiles.open(output_path, "wb") as f:
+            await f.write(output_bytes)
         
         return PDFSplitResponse(
             status="success",
             message=f"Extracted pages {pages} successfully",
-            download_url=f"/download/{file_id}_split.pdf",
+            download_url=f"/download/{split_id}_split.pdf",
             metadata=metadata,
-            extracted_text=extracted_text.strip(),
-            file_size=f"{len(output_buffer.getvalue()) / 1024:.2f} KB"
+            extracted_text=extracted_text,
+            file_size=f"{len(output_bytes) / 1024:.2f} KB"
         )
     
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error splitting PDF: {str(e)}")
+    finally:
+        await asyncio.to_thread(remove_if_exists, input_path)
 
-@app.post("/batch-process", response_model=BatchProcessResponse)
+@app.post("/batch-process")
 async def batch_process(files: List[UploadFile] = File(...), pages: str = "1", output_format: str = "pdf"):
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
     
     batch_id = str(uuid.uuid4())
     zip_filename = f"batch_{batch_id}.zip"
-    zip_path = os.path.join(UPLOAD_DIR, zip_filename)
     
-    processed_files = 0
     errors = []
+    pdf_files = []
+    for index, file in enumerate(files):
+        if not file.filename.lower().endswith('.pdf'):
+            errors.append(f"Skipped {file.filename}: Not a PDF file")
+            continue
+        pdf_files.append((index, file))
+    
+    if not pdf_files:
+        raise HTTPException(
+            status_code=400,
+            detail="No files were processed successfully: " + "; ".join(errors)
+        )
+    
+    # Reading, splitting and zipping run as pipeline stages joined by bounded queues,
+    # so uploads are still being read while earlier files are split and archived
+    worker_count = min(PDF_CONCURRENCY, len(pdf_files))
+    read_queue = asyncio.Queue(maxsize=BATCH_QUEUE_SIZE)
+    result_queue = asyncio.Queue(maxsize=BATCH_QUEUE_SIZE)
     
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for file in files:
+    async def read_uploads():
+        for index, file in pdf_files:
+            input_path = os.path.join(UPLOAD_DIR, f"batch_{batch_id}_{index}.pdf")
             try:
-                if not file.filename.lower().endswith('.pdf'):
-                    errors.append(f"Skipped {file.filename}: Not a PDF file")
-                    continue
-                
-                # Process each file
-                file_content = await file.read()
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-                total_pages = len(pdf_reader.pages)
-                
-                try:
-                    page_numbers = parse_page_selection(pages, total_pages)
-                except ValueError as e:
-                    errors.append(f"Skipped {file.filename}: {str(e)}")
-                    continue
-                
-                # Extract selected pages
-                pdf_writer = PyPDF2.PdfWriter()
-                for page_num in page_numbers:
-                    pdf_writer.add_page(pdf_reader.pages[page_num - 1])
-                
-                # Add to ZIP
-                output_buffer = io.BytesIO()
-                pdf_writer.write(output_buffer)
-                output_filename = f"extracted_{os.path.splitext(file.filename)[0]}.pdf"
-                zipf.writestr(output_filename, output_buffer.getvalue())
-                processed_files += 1
-                
+                await save_upload(file, input_path)
+                await read_queue.put((file.filename, input_path))
+            except asyncio.CancelledError:
+                # Not handed to a splitter yet, so nobody else will remove it
+                await asyncio.to_thread(remove_if_exists, input_path)
+                raise
             except Exception as e:
-                errors.append(f"Error processing {file.filename}: {str(e)}")
-    
-    if processed_files == 0:
-        os.remove(zip_path)
-        raise HTTPException(status_code=400, detail="No files were processed successfully")
-    
-    return BatchProcessResponse(
-        status="success",
-        message=f"Processed {processed_files} files",
-        download_url=f"/download/{zip_filename}",
-        processed_files=processed_files,
-        total_files=len(files),
-        errors=errors
+                await asyncio.to_thread(remove_if_exists, input_path)
+                await result_queue.put((file.filename, e))
+        
+        # One sentinel per splitter
+        for _ in range(worker_count):
+            await read_queue.put(None)
+    
+    async def split_uploads():
+        while (job := await read_queue.get()) is not None:
+            filename, input_path = job
+            try:
+                result = await run_batch_work(extract_pages, input_path, pages)
+            except Exception as e:
+                result = e
+            finally:
+                await asyncio.to_thread(remove_if_exists, input_path)
+            await result_queue.put((filename, result))
+        await result_queue.put(None)
+    
+    stages = [
+        asyncio.create_task(read_uploads()),
+        *(asyncio.create_task(split_uploads()) for _ in range(worker_count))
+    ]
+    finished_workers = 0
+    
+    async def next_result():
+        """Return the next (filename, result) from the pipeline, or None once it has finished"""
+        nonlocal finished_workers
+        while finished_workers < worker_count:
+            item = await result_queue.get()
+            if item is not None:
+                return item
+            finished_workers += 1
+        return None
+    
+    def record_error(filename, error):
+        if isinstance(error, ValueError):
+            errors.append(f"Skipped {filename}: {str(error)}")
+        else:
+            errors.append(f"Error processing {filename}: {str(error)}")
+    
+    async def stop_stages():
+        # A stage left waiting on a queue nobody reads would block forever
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        
+        # Uploads saved but never picked up by a splitter
+        while not read_queue.empty():
+            job = read_queue.get_nowait()
+            if job is not None:
+                await asyncio.to_thread(remove_if_exists, job[1])
+    
+    # Hold the response back until one file has been extracted, so a batch in
+    # which every file fails can still be answered with a 400
+    first_result = None
+    try:
+        while first_result is None and (item := await next_result()) is not None:
+            if isinstance(item[1], Exception):
+                record_error(*item)
+            else:
+                first_result = item
+    except BaseException:
+        await stop_stages()
+        raise
+    
+    if first_result is None:
+        await stop_stages()
+        raise HTTPException(
+            status_code=400,
+            detail="No files were processed successfully: " + "; ".join(errors)
+        )
+    
+    async def stream_archive():
+        """Write each extracted file into the ZIP as it arrives and send it straight on"""
+        processed_files = 0
+        sink = ZipChunkSink()
+        try:
+            # PDF streams are already compressed, so deflating them again buys almost nothing
+            with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zipf:
+                item = first_result
+                while item is not None:
+                    filename, result = item
+                    if isinstance(result, Exception):
+                        record_error(filename, result)
+                    else:
+                        output_filename = f"extracted_{os.path.splitext(filename)[0]}.pdf"
+                        await asyncio.to_thread(zipf.writestr, output_filename, result)
+                        processed_files += 1
+                        yield sink.drain()
+                    item = await next_result()
+                
+                # Headers are long gone by now, so the outcome travels in the archive
+                if errors:
+                    summary = [f"Processed {processed_files} of {len(files)} files", *errors]
+                    zipf.writestr("errors.txt", "\n".join(summary) + "\n")
+            yield sink.drain()
+        finally:
+            # Also reached when the client disconnects mid-download
+            await stop_stages()
+    
+    # The archive is written as it is sent, so its size isn't known up front
+    return StreamingResponse(
+        stream_archive(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{zip_filename}"',
+            "X-Total-Files": str(len(files))
+        }
     )
 
 @app.get("/download/{filename}")
 async def download_file(filename: str):
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    upload_root = os.path.abspath(UPLOAD_DIR)
+    file_path = os.path.abspath(os.path.join(upload_root, filename))
     
-    if not os.path.exists(file_path):
+    # Refuse anything that resolves outside the upload directory
+    if os.path.commonpath([upload_root, file_path]) != upload_root:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    
+    try:
+        stat_result = await asyncio.to_thread(os.stat, file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileResponse(file_path, filename=filename)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # Passing the stat result saves FileResponse a second stat before sending.
+    # Results are fetched once, so the file is removed as soon as it's been sent.
+    return FileResponse(
+        file_path,
+        filename=filename,
+        stat_result=stat_result,
+        background=BackgroundTask(remove_if_exists, file_path)
+    )
 
 if __name__ == "__main__":
     import uvicorn
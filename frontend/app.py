@@ -1,19 +1,42 @@
 # frontend/app.py (updated)
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 from io import BytesIO
 import pandas as pd
 import time
 import base64
 from PIL import Image
-import tempfile
 import zipfile
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configuration
 BACKEND_URL = "https://pdf-splitter-backend1.onrender.com"
+BATCH_WORKERS = 8  # Concurrent /split requests during batch processing
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+DOWNLOAD_SPOOL_SIZE = 64 * 1024 * 1024  # Downloads larger than this spill to disk
+
 st.set_page_config(page_title="PDF Agent Splitter", page_icon="✂️", layout="wide")
 
+@st.cache_resource
+def get_session():
+    """Shared HTTP session; cached so pooled keep-alive connections survive script reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+SESSION = get_session()
+
 # Custom CSS
 st.markdown("""
     <style>
@@ -55,25 +78,69 @@ st.markdown("""
 
 def display_pdf_preview(pdf_file):
     try:
-        # Display PDF preview (first page as image)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(pdf_file.getvalue())
-            tmp_path = tmp.name
+        # Reruns triggered by other widgets reuse the image rendered for this upload.
+        # A single slot is kept, so a new upload replaces the previous preview.
+        cached_file_id, img = st.session_state.get("pdf_preview", (None, None))
+        
+        if cached_file_id != pdf_file.file_id:
+            # Convert first page to image, straight from the uploaded bytes
+            import fitz  # PyMuPDF
+            with fitz.open(stream=pdf_file.getvalue(), filetype="pdf") as doc:
+                page = doc.load_page(0)
+                # A half-scale grayscale raster is plenty for a thumbnail
+                pix = page.get_pixmap(matrix=fitz.Matrix(0.5, 0.5), colorspace=fitz.csGRAY, alpha=False)
+                img = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+            st.session_state["pdf_preview"] = (pdf_file.file_id, img)
         
-        # Convert first page to image
-        import fitz  # PyMuPDF
-        doc = fitz.open(tmp_path)
-        page = doc.load_page(0)
-        pix = page.get_pixmap()
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
         st.image(img, caption="First Page Preview", use_column_width=True)
-        doc.close()
-        os.unlink(tmp_path)
     except Exception as e:
         st.warning(f"Couldn't generate preview: {str(e)}")
 
+@st.cache_data(show_spinner=False, ttl=1800)
+def fetch_metadata(file_name, file_bytes):
+    """Upload a PDF for analysis; cached so reruns don't re-send the same file"""
+    response = SESSION.post(
+        f"{BACKEND_URL}/upload",
+        files={"file": (file_name, file_bytes, "application/pdf")}
+    )
+    if response.status_code != 200:
+        raise RuntimeError(response.json().get("detail", "Unknown error"))
+    return response.json()
+
+def fetch_download(download_url):
+    """Stream a backend download into a spooled temp file; returns it rewound, or None on failure"""
+    with SESSION.get(download_url, stream=True, timeout=60) as response:
+        if response.status_code != 200:
+            return None
+        download_file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+        try:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                download_file.write(chunk)
+        except BaseException:
+            # Don't leave a half-written (possibly on-disk) spool behind
+            download_file.close()
+            raise
+    download_file.seek(0)
+    return download_file
+
+def split_single_file(file_name, file_bytes, page_selection, output_format):
+    """Run one file through the split endpoint and return the extracted PDF as a file object"""
+    response = SESSION.post(
+        f"{BACKEND_URL}/split",
+        files={"file": (file_name, file_bytes, "application/pdf")},
+        params={"pages": page_selection, "output_format": output_format},
+        timeout=60
+    )
+    if response.status_code != 200:
+        raise RuntimeError(response.json().get("detail", "Unknown error"))
+    
+    download_file = fetch_download(f"{BACKEND_URL}{response.json()['download_url']}")
+    if download_file is None:
+        raise RuntimeError("Failed to download extracted pages")
+    return download_file
+
 def process_batch_files(uploaded_files, page_selection, output_format):
-    """Process multiple files through the batch API endpoint"""
+    """Process multiple files through parallel split requests and zip the results locally"""
     if not uploaded_files:
         st.error("No files selected for batch processing")
         return None
@@ -81,58 +148,73 @@ def process_batch_files(uploaded_files, page_selection, output_format):
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    files_to_upload = []
-    for uploaded_file in uploaded_files:
-        files_to_upload.append(("files", (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")))
+    files_to_upload = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    
+    # Large batches spill to disk instead of holding the whole ZIP in memory
+    zip_file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
     
     try:
         status_text.markdown("Uploading and processing files...")
         
-        response = requests.post(
-            f"{BACKEND_URL}/batch-process",
-            files=files_to_upload,
-            data={"pages": page_selection, "output_format": output_format},
-            timeout=60  # Increased timeout for batch processing
-        )
+        errors = []
+        completed = 0
         
-        if response.status_code == 200:
-            result = response.json()
-            progress_bar.progress(100)
-            
-            if result["processed_files"] > 0:
-                status_text.markdown(
-                    f"<div class='success-message'>Processed {result['processed_files']} of {result['total_files']} files successfully</div>", 
-                    unsafe_allow_html=True
-                )
-                
-                # Show errors if any
-                if result["errors"]:
-                    with st.expander("Processing Errors", expanded=False):
-                        for error in result["errors"]:
-                            st.markdown(f"<div class='error-message'>{error}</div>", unsafe_allow_html=True)
-                
-                # Download button
-                download_url = f"{BACKEND_URL}{result['download_url']}"
-                response = requests.get(download_url)
+        # PDFs are stored as-is in the ZIP since their streams are already compressed.
+        # Worker threads only talk to the backend; Streamlit calls stay on this thread
+        with zipfile.ZipFile(zip_file, 'w', compression=zipfile.ZIP_STORED) as zipf, \
+                ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(files_to_upload))) as executor:
+            futures = {
+                executor.submit(split_single_file, file_name, file_bytes, page_selection, output_format): file_name
+                for file_name, file_bytes in files_to_upload
+            }
+            for future in as_completed(futures):
+                file_name = futures[future]
+                try:
+                    download_file = future.result()
+                except Exception as e:
+                    errors.append(f"Error processing {file_name}: {str(e)}")
+                else:
+                    # The download is complete by now, so only writing the ZIP itself can
+                    # fail here. That leaves a truncated entry behind, so end the batch
+                    # rather than ship the archive.
+                    with download_file, \
+                            zipf.open(f"extracted_{os.path.splitext(file_name)[0]}.pdf", 'w') as entry:
+                        shutil.copyfileobj(download_file, entry, DOWNLOAD_CHUNK_SIZE)
                 
-                if response.status_code == 200:
-                    st.download_button(
-                        label="Download All as ZIP",
-                        data=response.content,
-                        file_name=f"pdf_extractions_{int(time.time())}.zip",
-                        mime="application/zip"
-                    )
-                return result
-            else:
-                status_text.markdown(
-                    "<div class='error-message'>No files were processed successfully</div>", 
-                    unsafe_allow_html=True
-                )
-                return None
+                completed += 1
+                progress_bar.progress(int(completed * 100 / len(files_to_upload)))
+        
+        result = {
+            "processed_files": len(files_to_upload) - len(errors),
+            "total_files": len(files_to_upload),
+            "errors": errors
+        }
+        
+        if result["processed_files"] > 0:
+            status_text.markdown(
+                f"<div class='success-message'>Processed {result['processed_files']} of {result['total_files']} files successfully</div>", 
+                unsafe_allow_html=True
+            )
+            
+            # Show errors if any
+            if result["errors"]:
+                with st.expander("Processing Errors", expanded=False):
+                    for error in result["errors"]:
+                        st.markdown(f"<div class='error-message'>{error}</div>", unsafe_allow_html=True)
+            
+            # Download button. Streamlit takes bytes or a plain binary stream, not a
+            # spooled file, and keeps its own in-memory copy either way
+            zip_file.seek(0)
+            st.download_button(
+                label="Download All as ZIP",
+                data=zip_file.read(),
+                file_name=f"pdf_extractions_{int(time.time())}.zip",
+                mime="application/zip"
+            )
+            return result
         else:
-            error_detail = response.json().get("detail", "Unknown error")
             status_text.markdown(
-                f"<div class='error-message'>Error: {error_detail}</div>", 
+                "<div class='error-message'>No files were processed successfully</div>", 
                 unsafe_allow_html=True
             )
             return None
@@ -143,6 +225,8 @@ def process_batch_files(uploaded_files, page_selection, output_format):
             unsafe_allow_html=True
         )
         return None
+    finally:
+        zip_file.close()
 
 def main():
     st.title("✂️ PDF Agent Splitter")
@@ -184,14 +268,16 @@ def main():
             
             with col1:
                 st.subheader("File Information")
-                with st.spinner("Analyzing PDF..."):
-                    response = requests.post(
-                        f"{BACKEND_URL}/upload",
-                        files={"file": (uploaded_file.name, uploaded_file, "application/pdf")}
-                    )
+                file_id = None
+                try:
+                    with st.spinner("Analyzing PDF..."):
+                        result = fetch_metadata(uploaded_file.name, uploaded_file.getvalue())
+                except Exception as e:
+                    result = None
+                    st.error(f"Error: {str(e)}")
                 
-                if response.status_code == 200:
-                    result = response.json()
+                if result is not None:
+                    file_id = result.get("file_id")
                     st.success("PDF uploaded successfully!")
                     
                     st.markdown("#### Metadata")
@@ -212,8 +298,6 @@ def main():
                     st.table(metadata_df)
                     
                     st.markdown(f"**File Size:** {result['file_size']}")
-                else:
-                    st.error(f"Error: {response.json().get('detail', 'Unknown error')}")
             
             with col2:
                 st.subheader("Preview")
@@ -224,11 +308,21 @@ def main():
             
             if st.button("Extract Selected Pages", key="single_extract"):
                 with st.spinner("Extracting pages..."):
-                    split_response = requests.post(
-                        f"{BACKEND_URL}/split",
-                        files={"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")},
-                        data={"pages": page_selection, "output_format": output_format}
-                    )
+                    split_params = {"pages": page_selection, "output_format": output_format}
+                    split_response = None
+                    if file_id:
+                        # The backend already has this file from the upload above
+                        split_response = SESSION.post(
+                            f"{BACKEND_URL}/split",
+                            params={**split_params, "file_id": file_id}
+                        )
+                    if split_response is None or split_response.status_code == 404:
+                        # No file_id, or the backend no longer holds the cached upload
+                        split_response = SESSION.post(
+                            f"{BACKEND_URL}/split",
+                            files={"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")},
+                            params=split_params
+                        )
                 
                 if split_response.status_code == 200:
                     split_result = split_response.json()
@@ -246,15 +340,16 @@ def main():
                         st.markdown(f"**File Size:** {split_result['file_size']}")
                         
                         # Download button
-                        response = requests.get(download_url)
-                        if response.status_code == 200:
-                            st.download_button(
-                                label="Download Extracted PDF",
-                                data=response.content,
-                                file_name=f"extracted_{uploaded_file.name}",
-                                mime="application/pdf",
-                                key="single_download"
-                            )
+                        download_file = fetch_download(download_url)
+                        if download_file is not None:
+                            with download_file:
+                                st.download_button(
+                                    label="Download Extracted PDF",
+                                    data=download_file.read(),
+                                    file_name=f"extracted_{uploaded_file.name}",
+                                    mime="application/pdf",
+                                    key="single_download"
+                                )
                         else:
                             st.error("Failed to prepare download")
                 else: